@@ -1,7 +1,10 @@
+import errno
 import os
 import re
 import shutil
-from typing import Optional, List, Tuple, Dict
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple, Dict, Iterator, Callable
 
 # --- 定义月份替换映射表 (October -> November) ---
 
@@ -15,49 +18,139 @@ MONTH_REPLACEMENTS: Dict[str, str] = {
 }
 OCTOBER_KEYWORDS = list(MONTH_REPLACEMENTS.keys())
 
-def find_monthly_xlsx_files(base_path: str) -> List[Tuple[str, str]]:
+# 预编译正则：模块导入时只编译一次，避免每次调用/每个文件重复编译
+# 捕获组 (1) 即文件名中匹配到的精确关键词；前瞻确保其后是 .xlsx 结尾
+_MONTH_PATTERN = re.compile(
+    r"(?i)(" + "|".join(re.escape(k) for k in MONTH_REPLACEMENTS) + r")(?=[^/\\]*\.xlsx$)"
+)
+# 小写关键词集合，用于在进入正则之前做廉价的子串预筛
+_KW_LOWER = frozenset(k.lower() for k in MONTH_REPLACEMENTS)
+
+def _iter_xlsx_entries(path: str):
+    """
+    使用 os.scandir 递归遍历目录，依次产出其中的 .xlsx 文件条目 (os.DirEntry)。
+    与 os.walk 相同：先产出当前目录下的文件，再进入子目录；不跟随目录符号链接；无法读取的目录直接跳过。
+    """
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.lower().endswith(".xlsx"):
+                    yield entry
+    except OSError:
+        return
+    for subdir in subdirs:
+        yield from _iter_xlsx_entries(subdir)
+
+def find_monthly_xlsx_files(base_path: str, log: Callable[[str], None] = print) -> Iterator[Tuple[str, str]]:
     """
     在指定路径下递归查找文件名中包含特定月份关键词的 .xlsx 文件，
-    并返回文件路径和匹配到的第一个关键词。
+    边遍历边逐个产出文件路径和匹配到的第一个关键词（生成器，不会先收集完整列表）。
 
     参数:
     base_path (str): 开始查找的根目录路径。
-    month_keywords (List[str]): 包含所有月份标记关键词的列表。
+    log (Callable[[str], None]): 输出错误信息的函数，默认为 print。
 
     返回:
-    List[Tuple[str, str]]: 符合条件的文件完整路径和匹配到的关键词的列表。
-                            格式为 [(full_path, matched_keyword)]
+    Iterator[Tuple[str, str]]: 依次产出符合条件的文件完整路径和匹配到的关键词。
+                               格式为 (full_path, matched_keyword)
     """
     if not os.path.isdir(base_path):
-        print(f"错误: 路径不存在或不是目录: {base_path}")
-        return []
-
-    found_files_and_matches = []
-
-    # 将关键词列表转换为一个用于正则匹配的模式字符串
-    # 关键修改：使用非捕获组 (?:...) 并将整个模式放入捕获组 ()，以便找到精确匹配的词
-    pattern_parts = [re.escape(k) for k in OCTOBER_KEYWORDS]
-    # 使用 \b 来匹配单词边界，防止 "2010" 匹配到 "10"
-    search_pattern = re.compile(
-        f".*?({r'|'.join(pattern_parts)}).*?\\.xlsx$", 
-        re.IGNORECASE
-    )
-
-    for root, _, files in os.walk(base_path):
-        for file in files:
-            if file.lower().endswith(".xlsx"):
-                match = search_pattern.search(file) # 使用 search 查找匹配项
-                
-                if match:
-                    full_path = os.path.join(root, file)
-                    # match.group(1) 捕获到的是文件名中匹配到的精确关键词
-                    matched_keyword = match.group(1) 
-                    found_files_and_matches.append((full_path, matched_keyword))
-
-    return found_files_and_matches
-
-
-def copy_and_rename_file(source_path: str, matched_keyword: str, target_base_dir: str = None) -> Optional[str]:
+        log(f"错误: 路径不存在或不是目录: {base_path}")
+        return
+
+    for entry in _iter_xlsx_entries(base_path):
+        file = entry.name
+        # 预筛：文件名中不包含任何关键词的直接跳过，无需进入正则
+        name_lower = file.lower()
+        if not any(kw in name_lower for kw in _KW_LOWER):
+            continue
+
+        match = _MONTH_PATTERN.search(file) # 使用预编译的模式查找具体匹配到的关键词
+        
+        if match:
+            full_path = entry.path
+            # match.group(1) 捕获到的是文件名中匹配到的精确关键词
+            matched_keyword = match.group(1) 
+            yield (full_path, matched_keyword)
+
+
+# CopyFileExW 的 COPY_FILE_FAIL_IF_EXISTS 标志，以及目标已存在时返回的错误码
+_COPY_FILE_FAIL_IF_EXISTS = 0x00000001
+_WIN_FILE_EXISTS_ERRORS = (80, 183) # ERROR_FILE_EXISTS, ERROR_ALREADY_EXISTS
+
+
+def _copy_file_ex(source_path: str, target_path: str) -> bool:
+    """
+    Windows 上用 CopyFileExW 在系统内部完成复制，目标已存在时不覆盖。
+    成功返回 True；API 不可用或复制失败返回 False，由调用方回退；目标已存在时抛出 FileExistsError。
+    """
+    try:
+        import ctypes
+        kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    except (OSError, AttributeError, ImportError):
+        return False
+    if kernel32.CopyFileExW(source_path, target_path, None, None, None, _COPY_FILE_FAIL_IF_EXISTS):
+        shutil.copystat(source_path, target_path)
+        return True
+    if ctypes.get_last_error() in _WIN_FILE_EXISTS_ERRORS:
+        raise FileExistsError(errno.EEXIST, "目标文件已存在", target_path)
+    return False
+
+
+def _copy_file_range_all(fsrc, fdst) -> bool:
+    """
+    用 os.copy_file_range 在内核中把 fsrc 的全部内容复制到 fdst。
+    不支持 (平台、跨文件系统等) 或未能复制完整 (例如源文件在复制中变短) 时返回 False。
+    """
+    if not hasattr(os, "copy_file_range"):
+        return False
+    try:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+            if copied == 0:
+                return False
+            remaining -= copied
+    except OSError:
+        return False
+    return True
+
+
+def _fast_copy(source_path: str, target_path: str) -> None:
+    """
+    在内核中完成文件复制，避免数据在内核态与用户态之间来回拷贝：
+    Windows 使用 CopyFileExW，Linux 使用 os.copy_file_range，两者都不可用时回退到普通的逐块复制。
+    目标文件以独占方式 (O_EXCL) 创建：目标已存在时抛出 FileExistsError，绝不覆盖，
+    因此多个线程复制到同一目标时只有一个会成功。复制后保留源文件的修改时间和权限。
+    """
+    if sys.platform == "win32" and _copy_file_ex(source_path, target_path):
+        return
+
+    with open(source_path, "rb") as fsrc:
+        # "xb" 模式：目标已存在 (包括其他线程刚刚创建) 时直接失败
+        fdst = open(target_path, "xb")
+        try:
+            with fdst:
+                if not _copy_file_range_all(fsrc, fdst):
+                    # 内核复制不可用或不完整：从头用普通方式重新复制
+                    fsrc.seek(0)
+                    fdst.seek(0)
+                    fdst.truncate()
+                    shutil.copyfileobj(fsrc, fdst)
+            shutil.copystat(source_path, target_path)
+        except BaseException:
+            # 不留下不完整的目标文件，否则之后的运行会把它当作 "已存在" 而跳过
+            try:
+                os.remove(target_path)
+            except OSError:
+                pass
+            raise
+
+
+def copy_and_rename_file(source_path: str, matched_keyword: str, target_base_dir: str = None, verbose: bool = True, log: Callable[[str], None] = print) -> Optional[str]:
     """
     根据匹配到的月份关键词，生成新的文件名，并复制文件。
 
@@ -65,6 +158,8 @@ def copy_and_rename_file(source_path: str, matched_keyword: str, target_base_dir
     source_path (str): 源文件的完整路径。
     matched_keyword (str): 文件名中匹配到的月份关键词。
     target_base_dir (str): 目标目录。如果为 None，则复制到源文件的同一目录下。
+    verbose (bool): 是否打印每个文件的复制详情。在线程池中批量复制时可关闭，避免多线程输出交错。
+    log (Callable[[str], None]): 输出信息的函数，默认为 print；调用方可以传入 list.append 等收集输出，之后再统一写出。
 
     返回:
     Optional[str]: 新文件的完整路径，如果失败则返回 None。
@@ -86,36 +181,49 @@ def copy_and_rename_file(source_path: str, matched_keyword: str, target_base_dir
         # 如果匹配到的关键词不在替换表中，尝试查找仅包含数字或英文的替代关键词
         # 例如，如果匹配到 '10'，但用户文件中是 '10/'，我们只匹配了 '10'
         # 但如果 '10' 不在键中，我们无法替换，这里为了简化，我们只依赖精确匹配。
-        print(f"警告: 关键词 '{matched_keyword}' ({keyword_to_find}) 不在替换映射表中，跳过复制。")
+        log(f"警告: 关键词 '{matched_keyword}' ({keyword_to_find}) 不在替换映射表中，跳过复制。")
         return None
 
     # 生成新的文件名
-    # 注意：使用 re.sub 进行不区分大小写的替换
-    # re.escape 确保替换值中的特殊字符不会被误解析
-    new_filename = re.sub(
-        re.escape(matched_keyword),
-        re.escape(replacement),
-        original_filename,
-        flags=re.IGNORECASE,
-        count=1 # 只替换一次，避免文件名中多次出现月份标记导致的错误
-    )
+    # matched_keyword 是 find_monthly_xlsx_files 从文件名中截取的原文（保留原大小写），
+    # 它第一次出现的位置就是查找时正则匹配到的位置，直接按下标拼接即可，无需再做正则替换。
+    # 只替换一次，避免文件名中多次出现月份标记导致的错误
+    start = original_filename.find(matched_keyword)
+    if start >= 0:
+        end = start + len(matched_keyword)
+        new_filename = original_filename[:start] + replacement + original_filename[end:]
+    else:
+        # 调用方传入的关键词与文件名大小写不一致时，退回到不区分大小写的替换
+        # 注意：替换值通过函数返回，避免其中的反斜杠等字符被当作替换模板解析
+        new_filename = re.sub(
+            re.escape(matched_keyword),
+            lambda m: replacement,
+            original_filename,
+            count=1,
+            flags=re.IGNORECASE
+        )
     
     target_path = os.path.join(target_dir, new_filename)
     
-    # 避免新文件覆盖已有文件
-    if os.path.exists(target_path):
-        print(f"⚠️ 警告: 目标文件已存在，跳过复制以避免覆盖: {target_path}")
-        # 您可以选择返回现有的 target_path，或者返回 None
-        return target_path
     try:
-        shutil.copy2(source_path, target_path)
-        print(f"文件已复制并重命名:")
-        print(f"  原名: {original_filename}")
-        print(f"  新名: {new_filename}")
-        print(f"  位置: {target_path}")
+        # 避免新文件覆盖已有文件：_fast_copy 以独占方式创建目标，已存在时抛出 FileExistsError。
+        # 检查与创建是同一个原子操作，多个线程复制到同一目标时不会互相覆盖
+        # (放在 try 中：权限不足等其他错误与复制失败一样被报告，而不会中断整个流程)
+        try:
+            _fast_copy(source_path, target_path)
+        except FileExistsError:
+            log(f"⚠️ 警告: 目标文件已存在，跳过复制以避免覆盖: {target_path}")
+            # 您可以选择返回现有的 target_path，或者返回 None
+            return target_path
+
+        if verbose:
+            log(f"文件已复制并重命名:")
+            log(f"  原名: {original_filename}")
+            log(f"  新名: {new_filename}")
+            log(f"  位置: {target_path}")
         return target_path
     except Exception as e:
-        print(f"复制文件时出错: {e}")
+        log(f"复制文件时出错: {e}")
         return None
 
 # --- 使用示例 ---
@@ -130,21 +238,37 @@ if __name__ == "__main__":
 
     # 2. 定义十月关键词（确保它们是 MONTH_REPLACEMENTS 字典中的键）
     OCTOBER_KEYWORDS = list(MONTH_REPLACEMENTS.keys())
+    # 复制线程数：复制是纯 I/O 操作，少量线程即可让多个复制重叠进行
+    COPY_WORKERS = 8
+
+    # 在启动线程池之前创建一次目标目录，避免多个线程同时创建
+    if TARGET_COPY_PATH is not None:
+        os.makedirs(TARGET_COPY_PATH, exist_ok=True)
+
+    def copy_one(source_and_keyword: Tuple[str, str]) -> Tuple[str, Optional[str], bool]:
+        """在线程池中复制单个文件，返回 (源路径, 目标路径, 是否成功)，不打印逐个文件的详情"""
+        source_path, matched_keyword = source_and_keyword
+        target_path = copy_and_rename_file(source_path, matched_keyword, TARGET_COPY_PATH, verbose=False)
+        return (source_path, target_path, target_path is not None)
     
-    # 3. 查找文件和匹配项
-    print(f"--- 1. 正在搜索文件 ({BASE_SEARCH_PATH}) ---")
+    # 3. 查找文件和匹配项，并交给线程池复制：遍历产出的文件会被立即提交
+    print(f"--- 1. 正在搜索并复制文件 ({BASE_SEARCH_PATH}) ---")
     
-    # 查找并返回 [(full_path, matched_keyword)] 列表
-    result_files = find_monthly_xlsx_files(BASE_SEARCH_PATH, OCTOBER_KEYWORDS)
+    with ThreadPoolExecutor(max_workers=COPY_WORKERS) as executor:
+        copy_results = list(executor.map(copy_one, find_monthly_xlsx_files(BASE_SEARCH_PATH)))
 
-    if not result_files:
+    if not copy_results:
         print("\n未找到任何匹配十月关键词的 XLSX 文件。")
     else:
-        print(f"\n--- 2. 找到 {len(result_files)} 个文件，开始复制和重命名 ---")
-        
-        for source_path, matched_keyword in result_files:
-            # 复制并重命名文件
-            copy_and_rename_file(source_path, matched_keyword, TARGET_COPY_PATH)
-            print("-" * 20)
+        # 线程池关闭后统一打印汇总结果
+        print(f"\n--- 2. 共找到 {len(copy_results)} 个文件，复制和重命名结果如下 ---")
+        for source_path, target_path, ok in copy_results:
+            if ok:
+                print(f"✅ {os.path.basename(source_path)} -> {target_path}")
+            else:
+                print(f"❌ {os.path.basename(source_path)} 复制失败")
+        print("-" * 20)
+        success_count = sum(1 for _, _, ok in copy_results if ok)
+        print(f"成功: {success_count} / {len(copy_results)}")
             
     print("\n任务完成！")
\ No newline at end of file
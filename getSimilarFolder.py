@@ -20,20 +20,22 @@ def find_similar_subdirs(dir1_path: str, dir2_path, folder_name_filter: str, sim
     
     def get_first_level_subdirs(base_path: str, required_substring: str="") -> List[str]:
         """获取给定路径下的所有一级子目录名称（非嵌套）"""
-        if not os.path.isdir(base_path):
+        # 注意：这里使用了不区分大小写的查找，如果需要区分大小写，请移除 .lower()
+        required_substring_lower = required_substring.lower()
+
+        # 使用 os.scandir 一次遍历完成目录筛选和名称过滤：
+        # DirEntry.is_dir() 通常直接使用目录项中已有的类型信息，无需对每个条目再调用一次 stat。
+        # 路径是否为目录也直接由 scandir 判断 (打开失败即不是目录)，不再事先单独 isdir 一次
+        try:
+            with os.scandir(base_path) as it:
+                filtered_subdirs = [
+                    entry.name for entry in it
+                    if entry.is_dir()
+                    and (not required_substring_lower or required_substring_lower in entry.name.lower())
+                ]
+        except (FileNotFoundError, NotADirectoryError):
             print(f"警告: 路径不存在或不是目录: {base_path}")
             return []
-        
-        # 使用 os.listdir 获取所有条目，并筛选出目录
-        subdirs = [
-            item for item in os.listdir(base_path) 
-            if os.path.isdir(os.path.join(base_path, item))
-        ]
-        filtered_subdirs = [
-            subdir for subdir in subdirs
-            # 注意：这里使用了不区分大小写的查找，如果需要区分大小写，请移除 .lower()
-            if required_substring.lower() in subdir.lower() 
-        ]
         return filtered_subdirs
 
     subdirs1 = get_first_level_subdirs(dir1_path, folder_name_filter)
@@ -51,27 +53,79 @@ def find_similar_subdirs(dir1_path: str, dir2_path, folder_name_filter: str, sim
     
     matched_pairs = []
     
-    # 创建一个副本，用于跟踪 dir2 中已经被匹配的子目录，避免重复匹配
-    unmatched_subdirs2 = list(subdirs2) 
-    
-    for name1 in subdirs1:
-        best_match_name = None
+    # 预先计算小写名称，避免在内层循环中重复计算
+    lower1 = [s.lower() for s in subdirs1]
+    lower2 = [s.lower() for s in subdirs2]
+
+    # 标记 dir2 中已经被匹配的子目录 (0 = 可用, 1 = 已匹配)，避免重复匹配；
+    # 按下标置位是 O(1)，不需要像 list.remove 那样线性查找
+    matched_indices2 = bytearray(len(subdirs2))
+    # 每个 name1 的匹配结果 (dir2 下标, 相似度)，最后按 subdirs1 的顺序输出
+    best_matches = [None] * len(subdirs1)
+
+    # 第 1 轮：名称（忽略大小写）完全相同的直接配对，相似度为 1.0，完全不需要 SequenceMatcher
+    exact_index2 = {}
+    for j, low in enumerate(lower2):
+        exact_index2.setdefault(low, j)
+    for i, low in enumerate(lower1):
+        j = exact_index2.pop(low, None)
+        if j is not None:
+            best_matches[i] = (j, 1.0)
+            matched_indices2[j] = 1
+
+    len2 = [len(s) for s in lower2]
+
+    # 为 dir2 的每个名称预先创建一个 SequenceMatcher，并把该名称作为 seq2：
+    # SequenceMatcher 只为 seq2 建立并缓存 b2j 索引，之后用 set_seq1 更换 name1 时不需要重建，
+    # 因此每个 name2 的索引在整个匹配过程中只构建一次。
+    # 参数顺序与原先的 SequenceMatcher(None, name1, name2) 保持一致 (ratio 与参数顺序有关)
+    matchers2 = [difflib.SequenceMatcher(None, "", s) for s in lower2]
+
+    for i, name1 in enumerate(subdirs1):
+        if best_matches[i] is not None:
+            continue
+
+        best_match_index = None
         max_ratio = similarity_threshold # 至少要高于阈值
+        len1 = len(lower1[i])
         
-        for name2 in unmatched_subdirs2:
-            # SequenceMatcher 忽略大小写和空格会更灵活，但这里使用原始名称
-            matcher = difflib.SequenceMatcher(None, name1.lower(), name2.lower())
+        for j in range(len(subdirs2)):
+            if matched_indices2[j]:
+                continue
+
+            # 快速路径：名称（忽略大小写）完全相同，相似度即为 1.0，不可能有更好的匹配
+            if lower1[i] == lower2[j]:
+                max_ratio = 1.0
+                best_match_index = j
+                break
+
+            # 第 2 轮：长度上界 2*min(l1,l2)/(l1+l2)，如果连上界都达不到当前最佳值就直接跳过
+            if 2 * min(len1, len2[j]) / (len1 + len2[j]) <= max_ratio:
+                continue
+
+            # 第 3 轮：只有通过长度上界的候选才进入 SequenceMatcher
+            matcher = matchers2[j]
+            matcher.set_seq1(lower1[i])
+            # quick_ratio() 是 ratio() 的上界，先用它提前排除
+            if matcher.quick_ratio() <= max_ratio:
+                continue
+            # 完整的 ratio() 复用该 name2 已缓存的 b2j 索引
             current_ratio = matcher.ratio()
             
             if current_ratio > max_ratio:
                 max_ratio = current_ratio
-                best_match_name = name2
+                best_match_index = j
         
         # 如果找到最佳匹配且相似度达到阈值
-        if best_match_name:
-            matched_pairs.append((os.path.join(dir1_path,name1), os.path.join(dir2_path,best_match_name), max_ratio))
-            # 从待匹配列表中移除已匹配的子目录
-            unmatched_subdirs2.remove(best_match_name)
+        if best_match_index is not None:
+            best_matches[i] = (best_match_index, max_ratio)
+            # 标记该子目录已被匹配
+            matched_indices2[best_match_index] = 1
+
+    for name1, match in zip(subdirs1, best_matches):
+        if match is not None:
+            j, ratio = match
+            matched_pairs.append((os.path.join(dir1_path,name1), os.path.join(dir2_path,subdirs2[j]), ratio))
     
     return matched_pairs
 
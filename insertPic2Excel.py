@@ -1,15 +1,19 @@
+import io
 import os
 import re
 import tempfile
-from openpyxl import Workbook, load_workbook
+import threading
+from bisect import bisect_left
+from itertools import accumulate
+from openpyxl import load_workbook
 from openpyxl.drawing.image import Image as ExcelImage
 from openpyxl.styles import PatternFill
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Union, BinaryIO, Callable
 import fitz # PyMuPDF 导入时使用 fitz
 from PIL import Image as PILImage
 from difflib import SequenceMatcher
 from datetime import datetime # 引入 datetime 库获取当前日期
-from openpyxl.utils.cell import coordinate_from_string
+from openpyxl.utils.cell import column_index_from_string
 import openpyxl.utils.units as units
 from openpyxl.drawing.spreadsheet_drawing import OneCellAnchor, TwoCellAnchor
 
@@ -17,12 +21,88 @@ TARGET_MAX_WIDTH = 400  # 目标最大宽度（像素）
 TARGET_MAX_HEIGHT = 400 # 目标最大高度（像素）
 # openpyxl 默认行高单位 (1/400英寸)，像素转行高的近似比例，需要根据字体调整
 ROW_HEIGHT_SCALE = 0.75 # 假设 1 像素大约等于 0.75 openpyxl 高度单位
+DEFAULT_ROW_HEIGHT_PX = 20 # Excel 默认行高约 15 points = 20 像素
+
+# PDF 渲染参数 (dpi 可以控制图片清晰度)，渲染矩阵只需构建一次
+PDF_RENDER_DPI = 200
+_PDF_MATRIX_200DPI = fitz.Matrix(PDF_RENDER_DPI / 72, PDF_RENDER_DPI / 72)
+# PDF 页面直接在内存中编码为 JPEG 后插入 (比 PNG 更小、编码更快)
+PDF_JPEG_QUALITY = 85
+# 是否在 PDF 同目录的 _temp_img 下缓存渲染结果，供之后的运行复用
+CACHE_PDF_PAGES = True
+# PyMuPDF 不支持多线程 (即使每个线程使用各自的 Document，MuPDF 的全局上下文也是共享的)。
+# 调用方可能在多个线程中同时处理不同的 Excel 文件，所有 fitz 操作都需持有此锁
+_FITZ_LOCK = threading.Lock()
+
+# --- 工作表评分与格式化使用的常量（模块导入时只构建一次） ---
+RECEIPT_KEYWORDS = ["Receipts", "收据", "支出收据", "Invoice"]
+_RECEIPT_KEYWORDS_LOWER = tuple(k.lower() for k in RECEIPT_KEYWORDS)
+
+# 定义绿色填充样式
+# RGB 颜色代码，例如 '00FF00' 是纯绿色，'C6EFCE' 是 Excel 中的浅绿色
+_GREEN_FILL = PatternFill(start_color='006100', end_color='006100', fill_type='solid')
+
+# A 列到 N 列的列名
+_COLUMNS_TO_FORMAT = tuple(chr(ord('A') + i) for i in range(14)) # A, B, C, ..., N
+MARKER_COLUMN_LETTER = 'O' # 使用 O 列作为月份标记列
+
+# 定义关键词和权重
+TARGET_YEAR = "2025"
+EXCLUDE_YEAR = "2024" # 新增排除关键词
+
+# 权重设定
+SCORE_TARGET_YEAR = 100        # 包含 2025 给予高分
+PENALTY_EXCLUDE_YEAR = -200    # 包含 2024 给予极低的分数 (确保其被忽略)
+SCORE_RECEIPT_BASE = 10
+
+def _row_height_prefix_sums(sheet) -> List[int]:
+    """
+    计算工作表各行高度（像素）的前缀和：返回列表的第 k 项为第 1..k 行的总高度（第 0 项为 0）。
+    只覆盖到最后一个自定义行高的行，之后的行均为默认行高，可直接按算术计算。
+    """
+    custom_heights_px = {
+        row: int(units.points_to_pixels(dim.height))
+        for row, dim in sheet.row_dimensions.items()
+        if dim.customHeight and dim.height is not None
+    }
+    last_custom_row = max(custom_heights_px, default=0)
+    heights_px = (custom_heights_px.get(row, DEFAULT_ROW_HEIGHT_PX) for row in range(1, last_custom_row + 1))
+    return list(accumulate(heights_px, initial=0))
+
+def _find_image_end_row(prefix_sums: List[int], start_row: int, image_height_px: int) -> int:
+    """
+    根据行高前缀和，用二分查找确定从 start_row 开始、高度为 image_height_px 的图片覆盖到的最后一行：
+    即满足 第 start_row..r 行总高度 >= 图片高度 的最小行号 r。
+    """
+    if image_height_px <= 0:
+        return start_row
+
+    last_known_row = len(prefix_sums) - 1
+
+    def cumulative_height(row: int) -> int:
+        # 超出前缀和范围的行均为默认行高
+        if row <= last_known_row:
+            return prefix_sums[row]
+        return prefix_sums[-1] + (row - last_known_row) * DEFAULT_ROW_HEIGHT_PX
+
+    target = cumulative_height(start_row - 1) + image_height_px
+
+    if target <= prefix_sums[-1]:
+        end_row = bisect_left(prefix_sums, target)
+    else:
+        # 目标超出自定义行范围：剩余高度按默认行高向上取整
+        remaining = target - prefix_sums[-1]
+        end_row = last_known_row + int(-(-remaining // DEFAULT_ROW_HEIGHT_PX))
+
+    return max(end_row, start_row)
 
 def get_max_image_row(sheet) -> int:
     """
     遍历工作表中的图片，找到它们覆盖到的最大行号，兼容 OneCellAnchor 和 TwoCellAnchor。
     """
     max_image_end_row = 0
+    # 行高前缀和只在需要时计算一次，所有 OneCellAnchor 图片共用
+    prefix_sums = None
     
     # openpyxl 图像对象列表位于内部属性 _images 或 _charts
     # 遍历所有 Drawing 对象（包括图片、图表等）以覆盖所有情况
@@ -43,44 +123,20 @@ def get_max_image_row(sheet) -> int:
             # 1. 获取起始行 (from.row 是起始行索引)
             start_row = anchor._from.row + 1 # 索引转 Excel 行号
             
-            # 2. 获取图片高度 (图片在 Excel中的尺寸，单位 EMU)
-            if hasattr(drawing, 'height') and drawing.height is not None:
-                image_height_emu = drawing.height
-            elif hasattr(drawing.drawing, 'height') and drawing.drawing.height is not None:
-                image_height_emu = drawing.drawing.height
+            # 2. 获取图片在工作表中显示的高度：取锚点的 ext (单位 EMU)。
+            #    重新加载的工作簿中，drawing.height 是图片文件的原始像素高度，而不是显示尺寸
+            ext = anchor.ext
+            if ext is not None and ext.height:
+                image_height_px = units.EMU_to_pixels(ext.height)
             else:
                 # 无法获取高度，只能假设它只占一行
                 max_image_end_row = max(max_image_end_row, start_row)
                 continue
 
-            # 3. 计算图片占用的行数（这是一个复杂的近似计算）
-            # 遍历起始行及之后的行，累加其高度，直到覆盖图片高度
-            current_height_emu = 0
-            end_row = start_row
-            
-            # 迭代计算图片会覆盖到的行
-            while current_height_emu < image_height_emu:
-                # 检查行维度是否存在，如果不存在，使用默认高度
-                if end_row in sheet.row_dimensions and sheet.row_dimensions[end_row].customHeight:
-                    row_height_pts = sheet.row_dimensions[end_row].height
-                    row_height_emu = units.points_to_pixels(row_height_pts) * 9525 # 粗略转换
-                else:
-                    # 使用默认行高 (约 15 points = 190500 EMU)
-                    row_height_emu = 190500 
-
-                current_height_emu += row_height_emu
-                
-                # 如果这是第一行，且高度足够，不递增行号，否则递增
-                if end_row == start_row and current_height_emu >= image_height_emu:
-                    # 图片的高度小于或等于第一行，结束行就是起始行
-                    break 
-                elif end_row > start_row and current_height_emu >= image_height_emu:
-                    # 图片覆盖了前几行，但最后一行只需要一部分空间
-                    break
-                
-                end_row += 1
-            
-            image_end_row = end_row
+            # 3. 计算图片占用的行数：在行高前缀和上二分查找，避免逐行累加
+            if prefix_sums is None:
+                prefix_sums = _row_height_prefix_sums(sheet)
+            image_end_row = _find_image_end_row(prefix_sums, start_row, image_height_px)
             
         else:
             # 遇到其他未知的锚点类型，跳过
@@ -91,19 +147,20 @@ def get_max_image_row(sheet) -> int:
         
     return max_image_end_row
 
-def resize_image_for_excel(path_to_insert: str) -> Optional[ExcelImage]:
+def resize_image_for_excel(path_or_bytes: Union[str, BinaryIO], log: Callable[[str], None] = print) -> Optional[ExcelImage]:
     """
     加载图片文件，将其尺寸等比例缩放至 Excel 目标尺寸，并返回 openpyxl Image 对象。
 
     参数:
-    path_to_insert (str): 图片文件的完整路径。
+    path_or_bytes (Union[str, BinaryIO]): 图片文件的完整路径，或内存中的图片数据 (如 io.BytesIO)。
+    log (Callable[[str], None]): 输出错误信息的函数，默认为 print。
 
     返回:
     Optional[ExcelImage]: 调整好尺寸的 openpyxl Image 对象，如果失败则返回 None。
     """
     try:
-        # 1. 加载图片以获取原始尺寸
-        img = ExcelImage(path_to_insert)
+        # 1. 加载图片以获取原始尺寸 (openpyxl 内部用 PIL.Image.open 读取，只解析文件头，不解码像素)
+        img = ExcelImage(path_or_bytes)
         
         original_width = img.width
         original_height = img.height
@@ -125,7 +182,8 @@ def resize_image_for_excel(path_to_insert: str) -> Optional[ExcelImage]:
         return img
     except Exception as e:
         # 如果是图片格式错误或其他加载问题，在这里捕获
-        print(f"缩放图片 {os.path.basename(path_to_insert)} 时发生错误: {e}")
+        image_name = os.path.basename(path_or_bytes) if isinstance(path_or_bytes, str) else "<内存图片>"
+        log(f"缩放图片 {image_name} 时发生错误: {e}")
         return None
 
 def adjust_row_height(sheet, current_row: int, image_height_px: int) -> None:
@@ -142,67 +200,23 @@ def adjust_row_height(sheet, current_row: int, image_height_px: int) -> None:
     # 否则保持现有行高（如果更高）
 
 
-def find_first_empty_row_and_format(file_path: str) -> Optional[Tuple[str, str]]:
+def _select_target_sheet(sheet_names: List[str], log: Callable[[str], None] = print) -> Optional[str]:
     """
-    找出一个 Excel 文件中，名称相似的工作表内没有内容的第一行。
-    将该行的 A 到 N 列变成绿色，并返回工作簿名称和下一行的起始单元格位置。
-
-    参数:
-    file_path (str): XLSX 文件的完整路径。
-
-    返回:
-    Optional[Tuple[str, str]]: (工作簿名称, 下一行的起始单元格位置)，如果找到并格式化成功；
-                               如果文件不存在或找不到目标工作表，则返回 None。
+    根据名称为每个工作表评分 (年份 + 收据关键词相似度)，返回得分最高的工作表名称；
+    如果找不到任何相关的工作表，则返回 None。
     """
-    if not os.path.exists(file_path):
-        print(f"错误: 文件不存在 -> {file_path}")
-        return None
-
-    # 定义目标工作表名称的关键词（不区分大小写）
-    if not os.path.exists(file_path):
-        print(f"错误: 文件不存在 -> {file_path}")
-        return None
-
-    # --- 1. 获取当前月份标记 ---
-    current_month_marker = datetime.now().strftime("%Y-%m") # 格式如 '2025-11'
-    print(f"当前月份标记: {current_month_marker}")
-    
-    # --- 2. 标记列和格式化列定义 ---
-    MARKER_COLUMN_LETTER = 'O' # 使用 O 列作为月份标记列
-       
-    # 定义关键词和权重
-    RECEIPT_KEYWORDS = ["Receipts", "收据", "支出收据", "Invoice"]
-    TARGET_YEAR = "2025"
-    EXCLUDE_YEAR = "2024" # 新增排除关键词
-
-    # 权重设定
-    SCORE_TARGET_YEAR = 100        # 包含 2025 给予高分
-    PENALTY_EXCLUDE_YEAR = -200    # 包含 2024 给予极低的分数 (确保其被忽略)
-    SCORE_RECEIPT_BASE = 10
-    
-    # 定义绿色填充样式
-    # RGB 颜色代码，例如 '00FF00' 是纯绿色，'C6EFCE' 是 Excel 中的浅绿色
-    GREEN_FILL = PatternFill(start_color='006100', end_color='006100', fill_type='solid')
-       
-    # A 列到 N 列的列名
-    COLUMNS_TO_FORMAT = [chr(ord('A') + i) for i in range(14)] # A, B, C, ..., N
-
-    try:
-        # 1. 加载工作簿
-        workbook = load_workbook(file_path)
-    except Exception as e:
-        print(f"错误: 无法加载工作簿 -> {e}")
-        return None
-    
-    target_sheet = None
-    
-    # 2. 遍历工作表，寻找目标名称
     best_sheet_name = None
     max_score = -999 # 初始化为更小的负数
     
-    print("开始评分工作表:")
+    log("开始评分工作表:")
 
-    for sheet_name in workbook.sheetnames:
+    # 每个关键词各创建一个 SequenceMatcher，并把关键词作为 seq2：SequenceMatcher 只为 seq2
+    # 建立并缓存 b2j 索引，之后每个工作表只需 set_seq1，关键词的索引在本次调用中只构建一次。
+    # 参数顺序与原先的 SequenceMatcher(None, 工作表名, 关键词) 保持一致 (ratio 与参数顺序有关)。
+    # 这些 matcher 有状态，而本函数可能被多个线程同时调用，因此在每次调用内创建而不是放在模块级别
+    keyword_matchers = [SequenceMatcher(None, "", kw) for kw in _RECEIPT_KEYWORDS_LOWER]
+
+    for sheet_name in sheet_names:
         lower_name = sheet_name.lower()
         current_score = 0
         
@@ -217,15 +231,16 @@ def find_first_empty_row_and_format(file_path: str) -> Optional[Tuple[str, str]]
         # 1.3. 评分：收据/Receipts 关键词
         max_receipt_ratio = 0.0
         
-        for keyword in RECEIPT_KEYWORDS:
+        for matcher in keyword_matchers:
             # 计算工作表名和核心关键词的最高相似度
-            ratio = SequenceMatcher(None, lower_name, keyword.lower()).ratio()
+            matcher.set_seq1(lower_name)
+            ratio = matcher.ratio()
             max_receipt_ratio = max(max_receipt_ratio, ratio)
         
         # 将相似度百分比作为权重添加到基础分数上
         current_score += SCORE_RECEIPT_BASE * max_receipt_ratio
         
-        print(f"  - '{sheet_name}' 评分: {current_score:.2f} (2025: {TARGET_YEAR in lower_name}, 2024: {EXCLUDE_YEAR in lower_name})")
+        log(f"  - '{sheet_name}' 评分: {current_score:.2f} (2025: {TARGET_YEAR in lower_name}, 2024: {EXCLUDE_YEAR in lower_name})")
 
         # 1.4. 选择最高分
         if current_score > max_score:
@@ -233,54 +248,49 @@ def find_first_empty_row_and_format(file_path: str) -> Optional[Tuple[str, str]]
             best_sheet_name = sheet_name
         
     if best_sheet_name is None or max_score <= PENALTY_EXCLUDE_YEAR: # 确保得分极低的表不被选中
-        print("未找到任何相关的工作表。")
+        log("未找到任何相关的工作表。")
         return None
 
-    target_sheet = workbook[best_sheet_name]
-    print(f"✅ 最终选定目标工作表: {best_sheet_name} (最高分: {max_score:.2f})")
+    log(f"✅ 最终选定目标工作表: {best_sheet_name} (最高分: {max_score:.2f})")
+    return best_sheet_name
 
-    # 3. 查找第一个空行
-    # max_row 是包含内容的行数（或至少有格式的行数）。
-    # 我们可以从 max_row + 1 开始检查，或者从第一行开始检查直到遇到空行。
-    
-    first_untagged_empty_row = None
+def _find_last_content_row(sheet, current_month_marker: str, log: Callable[[str], None] = print) -> int:
+    """
+    扫描工作表的 A-N 列，返回最后一个有内容的行号；
+    A-N 列为空但 O 列已被当前月份标记的行同样视为已处理。没有任何内容时返回 0。
+    """
     last_content_row = 0
-    max_row_to_check = target_sheet.max_row + 100
-    # 循环从第 1 行开始，确保检查所有可能的行
-    print(f"正在扫描工作表 '{best_sheet_name}' (最大行号 {target_sheet.max_row}) 寻找最后的内容行...")
-    for row_num in range(1,max_row_to_check):
-        
-        is_row_content_present = False
-    
-        # 只检查 A-N 列是否有内容
-        for col_letter in COLUMNS_TO_FORMAT:
-            cell = target_sheet[f'{col_letter}{row_num}']
-            
-            # 排除已标记行中的空值，以免将标记行算作内容行
-            marker_cell = target_sheet[f'{MARKER_COLUMN_LETTER}{row_num}'] # O 列标记
-
-            # 检查 A-N 列是否有内容，同时忽略已被当前月份标记的行（如果标记行A-N是空的）
-            if cell.value is not None and str(cell.value).strip() != "":
-                # 找到内容了，更新最大行号，并退出内层循环
-                last_content_row = row_num
-                is_row_content_present = True
-                break
-                
-            # 如果行是空的，但 O 列已经被标记了，我们仍然认为它已经被处理过了
-            if col_letter == COLUMNS_TO_FORMAT[0] and marker_cell.value is not None and str(marker_cell.value).strip() == current_month_marker:
-                # 标记行，即使A-N是空的，也应该算作“已处理”
-                last_content_row = row_num
-                # 不需要 break，让它继续检查 A-N 列
-                
-        # 优化：如果当前行和之前的行是空的，并且超过了上一次找到的最大内容行，则可以提前退出扫描。
-        # 但为了稳妥，我们让它继续扫描到 max_row + 100 的边界。
-    if target_sheet._images:
-        max_image_row = get_max_image_row(target_sheet)
+    # O 列 (标记列) 的列号 (从 1 开始)；A-N 列即其之前的所有列
+    marker_col_idx = column_index_from_string(MARKER_COLUMN_LETTER)
+    # iter_rows(values_only=True) 直接返回单元格值元组，不会逐个构造 Cell 对象，
+    # 也不会像按坐标访问那样在工作表末尾凭空创建空单元格
+    log(f"正在扫描工作表 '{sheet.title}' (最大行号 {sheet.max_row}) 寻找最后的内容行...")
+    for row_num, row in enumerate(sheet.iter_rows(min_row=1, max_col=marker_col_idx, values_only=True), 1):
+        # 检查 A-N 列是否有内容
+        if any(v is not None and str(v).strip() != "" for v in row[:marker_col_idx - 1]):
+            last_content_row = row_num
+            continue
+
+        # 如果行是空的，但 O 列已经被标记了，我们仍然认为它已经被处理过了
+        marker_value = row[marker_col_idx - 1] if len(row) >= marker_col_idx else None
+        if marker_value is not None and str(marker_value).strip() == current_month_marker:
+            # 标记行，即使A-N是空的，也应该算作“已处理”
+            last_content_row = row_num
+
+    return last_content_row
+
+def _format_next_empty_row(sheet, last_content_row: int, current_month_marker: str, log: Callable[[str], None] = print) -> int:
+    """
+    结合图片覆盖到的行确定第一个未标记的空行，将该行 A-N 列设置为绿色并在 O 列写入月份标记。
+    该函数只修改内存中的工作表，不保存文件。返回被格式化的行号。
+    """
+    if sheet._images:
+        max_image_row = get_max_image_row(sheet)
     else:
         max_image_row = 0
     
     last_known_row = max(last_content_row, max_image_row)
-    print(f"✅ 找到最后有内容的行 (或已标记行): 第 {last_known_row} 行")
+    log(f"✅ 找到最后有内容的行 (或已标记行): 第 {last_known_row} 行")
 
     # -------------------------------------------------------------------
     # 4. 确定下一个插入行 (last_content_row 的下一行)
@@ -292,34 +302,86 @@ def find_first_empty_row_and_format(file_path: str) -> Optional[Tuple[str, str]]
     # -------------------------------------------------------------------
 
     # ⚠️ 修复：现在需要检查新确定的行是否已经被标记过！
-    marker_cell_next = target_sheet[f'{MARKER_COLUMN_LETTER}{first_untagged_empty_row}']
+    marker_cell_next = sheet[f'{MARKER_COLUMN_LETTER}{first_untagged_empty_row}']
     if marker_cell_next.value is not None and str(marker_cell_next.value).strip() == current_month_marker:
         # 这种情况理论上不应该发生，除非 Excel 尾部有重复的标记行。
-        print(f"警告: 第 {first_untagged_empty_row} 行已被标记。跳过格式化。")
+        log(f"警告: 第 {first_untagged_empty_row} 行已被标记。跳过格式化。")
         # 如果该行已标记，则下一行才是真正的空行
         first_untagged_empty_row += 1 
         
         # 重新获取单元格
-        marker_cell_to_set = target_sheet[f'{MARKER_COLUMN_LETTER}{first_untagged_empty_row}']
+        marker_cell_to_set = sheet[f'{MARKER_COLUMN_LETTER}{first_untagged_empty_row}']
     else:
         marker_cell_to_set = marker_cell_next
 
     # 格式化 A-N 列
-    for col_letter in COLUMNS_TO_FORMAT:
-        cell = target_sheet[f'{col_letter}{first_untagged_empty_row}']
-        cell.fill = GREEN_FILL
+    for col_letter in _COLUMNS_TO_FORMAT:
+        cell = sheet[f'{col_letter}{first_untagged_empty_row}']
+        cell.fill = _GREEN_FILL
         
     # 设置月份标记 (关键步骤)
     marker_cell_to_set.value = current_month_marker
         
-    print(f"✅ 已将第 {first_untagged_empty_row} 行设置为绿色，并标记 '{current_month_marker}' 在 {MARKER_COLUMN_LETTER} 列。")
+    log(f"✅ 已将第 {first_untagged_empty_row} 行设置为绿色，并标记 '{current_month_marker}' 在 {MARKER_COLUMN_LETTER} 列。")
+    return first_untagged_empty_row
+
+def _find_first_empty_row_and_format(workbook, log: Callable[[str], None] = print) -> Optional[Tuple[str, int]]:
+    """
+    在已加载 (可写) 的工作簿中选定目标工作表，找到第一个空行并完成格式化，但不保存文件，
+    以便调用方在同一个工作簿对象上继续操作、最后只保存一次。
+    所有状态信息都通过 log 输出 (默认为 print)。
+
+    返回:
+    Optional[Tuple[str, int]]: (工作表名称, 被格式化的行号)；找不到目标工作表时返回 None。
+    """
+    current_month_marker = datetime.now().strftime("%Y-%m") # 格式如 '2025-11'
+    log(f"当前月份标记: {current_month_marker}")
+
+    best_sheet_name = _select_target_sheet(workbook.sheetnames, log)
+    if best_sheet_name is None:
+        return None
+
+    target_sheet = workbook[best_sheet_name]
+    last_content_row = _find_last_content_row(target_sheet, current_month_marker, log)
+    formatted_row = _format_next_empty_row(target_sheet, last_content_row, current_month_marker, log)
+    return (best_sheet_name, formatted_row)
+
+def find_first_empty_row_and_format(file_path: str, log: Callable[[str], None] = print) -> Optional[Tuple[str, str]]:
+    """
+    找出一个 Excel 文件中，名称相似的工作表内没有内容的第一行。
+    将该行的 A 到 N 列变成绿色，并返回工作簿名称和下一行的起始单元格位置。
+
+    参数:
+    file_path (str): XLSX 文件的完整路径。
+    log (Callable[[str], None]): 输出状态信息的函数，默认为 print。
+
+    返回:
+    Optional[Tuple[str, str]]: (工作簿名称, 下一行的起始单元格位置)，如果找到并格式化成功；
+                               如果文件不存在或找不到目标工作表，则返回 None。
+    """
+    if not os.path.exists(file_path):
+        log(f"错误: 文件不存在 -> {file_path}")
+        return None
+
+    try:
+        # 只加载一次 (可写) 工作簿：选表、扫描空行和格式化都在同一个工作簿对象上完成。
+        # 只读模式依赖文件中的 <dimension> 标记确定行数，该标记经常过时，之后还得为格式化再完整加载一次
+        workbook = load_workbook(file_path)
+    except Exception as e:
+        log(f"错误: 无法加载工作簿 -> {e}")
+        return None
+
+    result = _find_first_empty_row_and_format(workbook, log)
+    if result is None:
+        return None
+    best_sheet_name, first_untagged_empty_row = result
         
     # 5. 保存工作簿
     try:
         workbook.save(file_path)
-        print("✅ 工作簿已保存。")
+        log("✅ 工作簿已保存。")
     except Exception as e:
-        print(f"错误: 无法保存工作簿。请确保文件未被其他程序打开。-> {e}")
+        log(f"错误: 无法保存工作簿。请确保文件未被其他程序打开。-> {e}")
         return None
     
     # 6. 返回结果
@@ -329,144 +391,232 @@ def find_first_empty_row_and_format(file_path: str) -> Optional[Tuple[str, str]]
     
     return (workbook_name, next_row_start_cell)
 
-def insert_images_to_excel_with_pdf(excel_path: str, file_paths: List[str] ):
+def _render_pdf_page(pdf_doc, page_num: int, out_path: Optional[str] = None, dpi: int = PDF_RENDER_DPI, log: Callable[[str], None] = print) -> bytes:
+    """
+    将已打开的 PDF 文档的某一页（页码从 0 开始）渲染为内存中的 JPEG 字节并返回。
+    如果提供了 out_path，同时把这些字节写入磁盘作为缓存 (写入失败的警告通过 log 输出)。
+    PyMuPDF 不支持多线程，调用方需持有 _FITZ_LOCK。
+    """
+    matrix = _PDF_MATRIX_200DPI if dpi == PDF_RENDER_DPI else fitz.Matrix(dpi / 72, dpi / 72)
+    pix = pdf_doc.load_page(page_num).get_pixmap(matrix=matrix, alpha=False)
+    jpeg_bytes = pix.tobytes("jpeg", jpg_quality=PDF_JPEG_QUALITY)
+
+    if out_path is not None:
+        _write_cache_file(out_path, jpeg_bytes, log)
+    return jpeg_bytes
+
+def _write_cache_file(out_path: str, data: bytes, log: Callable[[str], None] = print) -> None:
+    """
+    原子地写入缓存文件：先写入同目录下的临时文件，再用 os.replace 替换到目标位置，
+    写入中途被中断时不会留下不完整的缓存文件。写入失败只通过 log 输出警告，不影响本次插入。
+    """
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(out_path), prefix=os.path.basename(out_path) + ".", suffix=".tmp")
+    except OSError as e:
+        log(f"警告: 无法写入缓存文件 {out_path}: {e}")
+        return
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, out_path)
+    except OSError as e:
+        log(f"警告: 无法写入缓存文件 {out_path}: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def _remove_legacy_cache_file(pdf_img_dir: str, file_name: str, page_num: int) -> None:
+    """
+    删除旧版本留下的同一页 PNG 缓存 ({file_name}_page{n}.png)。
+    新的 JPEG 缓存写入后，这些文件不会再被使用。
+    """
+    try:
+        os.remove(os.path.join(pdf_img_dir, f"{file_name}_page{page_num+1}.png"))
+    except OSError:
+        # 文件不存在 (最常见的情况) 或无法删除，都不影响本次插入
+        pass
+
+def _is_valid_cache_file(cache_path: str, src_mtime: float) -> bool:
+    """
+    判断缓存的 JPEG 是否可以复用：文件存在、不旧于源 PDF，并且以 JPEG 结束标记 (EOI) 结尾。
+    只读取文件末尾两个字节，用来排除被截断的文件。
+    """
+    try:
+        if os.path.getmtime(cache_path) < src_mtime:
+            return False
+        with open(cache_path, "rb") as f:
+            f.seek(-2, os.SEEK_END)
+            return f.read(2) == b"\xff\xd9"
+    except OSError:
+        # 文件不存在，或者短于两个字节
+        return False
+
+def insert_images_to_excel_with_pdf(excel_path: str, file_paths: List[str], log: Callable[[str], None] = print):
     """
     将多个文件 (PNG, JPG, JPEG, PDF) 作为图片插入到指定的 Excel 工作表中。
-    PDF 文件会被转换为临时 PNG 图像后插入。
+    PDF 文件的每一页按 PDF_RENDER_DPI (200 DPI) 渲染，并在内存中编码为 JPEG (质量 PDF_JPEG_QUALITY = 85) 后插入。
+    注意 JPEG 是有损格式，文字和线条边缘可能出现轻微压缩痕迹 (原先为无损的 PNG)。
+    CACHE_PDF_PAGES 为 True 时，渲染结果同时缓存到 PDF 同目录的 _temp_img 文件夹下，供之后的运行复用。
 
     参数:
     excel_path (str): 要创建或修改的 Excel 文件路径。
     file_paths (List[str]): 文件（图片或 PDF）的完整路径列表。
+    log (Callable[[str], None]): 输出每一条状态信息的函数，默认为 print。
+                                 并行处理多个 Excel 时，调用方可以传入 list.append 等收集输出，之后再统一写出。
     """
 
     # 允许的图片文件扩展名
     ALLOWED_EXTENSIONS = ('.png', '.jpg', '.jpeg')
     
+    # 没有需要插入的文件时，不必加载工作簿
+    if not file_paths:
+        log("没有需要插入的文件，跳过。")
+        return
+
     # --- 1. 准备 Excel 工作簿 ---
-    # ... (这部分与原代码保持一致，用于加载/创建工作簿和工作表)
-    
-    # 检查文件是否存在，如果存在则加载，否则创建新的
-    if os.path.exists(excel_path):
-        try:
-            workbook = load_workbook(excel_path)
-        except Exception as e:
-            print(f"警告: 无法加载现有文件 {excel_path}，将创建新的工作簿。错误: {e}")
-            workbook = Workbook()
-    else:
-        workbook = Workbook()
+    # 整个流程只加载一次工作簿：定位/格式化空行和插入图片都在同一个工作簿对象上进行，最后只保存一次
+    if not os.path.exists(excel_path):
+        log(f"错误: 文件不存在 -> {excel_path}")
+        return
+
+    try:
+        workbook = load_workbook(excel_path)
+    except Exception as e:
+        log(f"错误: 无法加载工作簿 {excel_path}。错误: {e}")
+        return
         
-    print(f"正在分析 Excel 文件 '{excel_path}'，寻找插入位置...")
+    log(f"正在分析 Excel 文件 '{excel_path}'，寻找插入位置...")
     
-    # ⚠️ 确保 find_first_empty_row_and_format 返回 (best_sheet_name, next_row_start_cell)
-    result = find_first_empty_row_and_format(excel_path)
+    # 在内存中找到并格式化绿色标记行 (不保存)，返回 (best_sheet_name, formatted_row)
+    result = _find_first_empty_row_and_format(workbook, log)
     
     if result is None:
-        print("❌ 无法插入图片: find_first_empty_row_and_format 无法找到有效的插入位置。")
+        log("❌ 无法插入图片: 无法找到有效的插入位置。")
         return # 提前退出
         
-    # 覆盖 sheet_name 和 start_cell 变量
-    actual_sheet_name, actual_start_cell = result        
-    
-    try:
-        # 重新加载工作簿，包含 find_first_empty_row_and_format 写入的绿色标记行
-        workbook = load_workbook(excel_path)
-    except Exception as e:
-        print(f"错误: 无法重新加载工作簿 {excel_path}。错误: {e}")
-        return
+    actual_sheet_name, formatted_row = result
     
     sheet = workbook[actual_sheet_name]
     
     # --- 2. 确定图片起始位置 ---
 
-    col_str, row_idx = coordinate_from_string(actual_start_cell) # 使用确定的单元格
-    
-    current_row = row_idx
+    # 图片从绿色标记行的下一行、A 列开始插入
+    col_str = 'A'
+    current_row = formatted_row + 1
     success_count = 0
 
-    print(f"开始向工作表 '{actual_sheet_name}' 插入文件...")
+    log(f"开始向工作表 '{actual_sheet_name}' 插入文件...")
 
     # --- 3. 遍历文件并插入图片 ---
     for i, file_path in enumerate(file_paths):
         if not os.path.exists(file_path):
-            print(f"跳过: 文件不存在 - {file_path}")
+            log(f"跳过: 文件不存在 - {file_path}")
             continue
 
         file_ext = os.path.splitext(file_path)[1].lower()
         file_name = os.path.basename(file_path)
         
-        # 默认插入路径为原始文件路径
-        path_to_insert = file_path 
-        pdf_dir = os.path.dirname(file_path)
-        # 🎯 新的持久临时目录
-        pdf_img_dir = os.path.join(pdf_dir, "_temp_img") 
-        os.makedirs(pdf_img_dir, exist_ok=True) # 确保目录存在
         # --- PDF 特殊处理 ---
         if file_ext == '.pdf':
             try:
-                # 尝试打开 PDF
-                pdf_doc = fitz.open(file_path)                  
-                # 遍历 PDF 的每一页
-                for page_num in range(len(pdf_doc)):
-                    page = pdf_doc.load_page(page_num)
-                    
-                    # 设置渲染参数 (dpi可以控制图片清晰度)
-                    matrix = fitz.Matrix(200 / 72, 200 / 72) # 200 DPI
-                    pix = page.get_pixmap(matrix=matrix, alpha=False)
-
-                    # 生成临时 PNG 文件路径
-                    temp_png_path = os.path.join(pdf_img_dir, f"{file_name}_page{page_num+1}.png")
-                    
-                    # 保存为 PNG
-                    pix.save(temp_png_path)
-                    
-                    # 设置为当前插入路径，并更新文件名以在打印中显示页码
-                    path_to_insert = temp_png_path
-                    display_name = f"{file_name} (Page {page_num+1})"
-
-                    # 执行插入操作 (将插入操作放入循环内，处理PDF的每一页)
-                    try:
-                        img = resize_image_for_excel(path_to_insert)
-                        adjust_row_height(sheet, current_row, img.height)
-                        anchor_cell = f"{col_str}{current_row}"
-                        sheet.add_image(img, anchor_cell)
-                        print(f"成功插入: '{display_name}'，位置: {anchor_cell}")
-                        current_row += 1 
-                        success_count += 1
-                    except Exception as e:
-                        print(f"插入 PDF 图像 '{display_name}' 时发生错误: {e}")
+                if CACHE_PDF_PAGES:
+                    pdf_dir = os.path.dirname(file_path)
+                    # 🎯 新的持久临时目录
+                    pdf_img_dir = os.path.join(pdf_dir, "_temp_img") 
+                    os.makedirs(pdf_img_dir, exist_ok=True) # 确保目录存在
+                # 源文件的修改时间用于判断缓存是否过期，PDF 被修改后会重新渲染并覆盖同名缓存
+                src_mtime = os.path.getmtime(file_path)
+                # 整个 PDF 只打开一次：读取页数、渲染未缓存的页面都使用同一个文档对象；
+                # 持有 _FITZ_LOCK 期间，其他线程不会同时调用 PyMuPDF
+                with _FITZ_LOCK, fitz.open(file_path) as pdf_doc:
+                    page_count = len(pdf_doc)
+
+                    # 生成每一页的缓存文件路径 (缓存键: 文件名 + 页码 + DPI)；未启用缓存时为 None。
+                    # 缓存键中不包含修改时间，过期的缓存会被原地覆盖，不会在 _temp_img 中不断累积
+                    page_cache_paths = [
+                        os.path.join(pdf_img_dir, f"{file_name}_p{page_num+1}_{PDF_RENDER_DPI}.jpg")
+                        if CACHE_PDF_PAGES else None
+                        for page_num in range(page_count)
+                    ]
+
+                    # 每一页的插入来源：缓存文件路径或内存中的 JPEG 数据
+                    page_sources = [None] * page_count
+
+                    # 如果之前的运行已经渲染过某一页且缓存完整、不旧于源文件，则直接复用，跳过渲染；
+                    # 其余页面串行渲染 (PyMuPDF 不支持多线程)
+                    for page_num, cache_path in enumerate(page_cache_paths):
+                        if cache_path is not None and _is_valid_cache_file(cache_path, src_mtime):
+                            page_sources[page_num] = cache_path
+                            continue
+                        try:
+                            # 直接使用内存中的字节，无需再从磁盘读回
+                            page_sources[page_num] = io.BytesIO(_render_pdf_page(pdf_doc, page_num, cache_path, log=log))
+                            if cache_path is not None:
+                                _remove_legacy_cache_file(pdf_img_dir, file_name, page_num)
+                        except Exception as e:
+                            log(f"渲染 PDF '{file_name}' 第 {page_num+1} 页时发生错误: {e}")
+
+                    # 按页码顺序依次插入 (插入操作必须串行执行)
+                    for page_num, path_to_insert in enumerate(page_sources):
+                        if path_to_insert is None:
+                            # 渲染失败的页面
+                            continue
+
+                        # 更新文件名以在打印中显示页码
+                        display_name = f"{file_name} (Page {page_num+1})"
+
+                        # 执行插入操作 (将插入操作放入循环内，处理PDF的每一页)
+                        try:
+                            img = resize_image_for_excel(path_to_insert, log)
+                            if img is None and isinstance(path_to_insert, str):
+                                # 缓存文件无法打开 (例如已损坏)：删除后重新渲染该页，而不是在之后的每次运行中反复失败
+                                log(f"缓存文件无法使用，重新渲染: {os.path.basename(path_to_insert)}")
+                                try:
+                                    os.remove(path_to_insert)
+                                except OSError:
+                                    pass
+                                img = resize_image_for_excel(io.BytesIO(_render_pdf_page(pdf_doc, page_num, path_to_insert, log=log)), log)
+                            adjust_row_height(sheet, current_row, img.height)
+                            anchor_cell = f"{col_str}{current_row}"
+                            sheet.add_image(img, anchor_cell)
+                            log(f"成功插入: '{display_name}'，位置: {anchor_cell}")
+                            current_row += 1 
+                            success_count += 1
+                        except Exception as e:
+                            log(f"插入 PDF 图像 '{display_name}' 时发生错误: {e}")
                 
-                pdf_doc.close()
                 continue # 处理完 PDF 后，跳到下一个文件
                 
             except Exception as e:
-                print(f"处理 PDF 文件 '{file_name}' 时发生错误: {e}")
+                log(f"处理 PDF 文件 '{file_name}' 时发生错误: {e}")
                 continue
         
         # --- 正常图片文件处理 ---
         elif file_ext not in ALLOWED_EXTENSIONS:
-            print(f"跳过: 文件 '{file_name}' 格式 ({file_ext}) 不支持。")
+            log(f"跳过: 文件 '{file_name}' 格式 ({file_ext}) 不支持。")
             continue
         
         # 插入 PNG/JPG/JPEG 文件
         try:
-            img = resize_image_for_excel(file_path)
+            img = resize_image_for_excel(file_path, log)
             adjust_row_height(sheet, current_row, img.height)
             anchor_cell = f"{col_str}{current_row}"
             sheet.add_image(img, anchor_cell)
-            print(f"成功插入: '{file_name}'，位置: {anchor_cell}")
+            log(f"成功插入: '{file_name}'，位置: {anchor_cell}")
             current_row += 1 
             success_count += 1
         except Exception as e:
-            print(f"插入图片 '{file_name}' 时发生错误: {e}")
+            log(f"插入图片 '{file_name}' 时发生错误: {e}")
 
     # --- 4. 保存工作簿 ---
     try:
         workbook.save(excel_path)
-        print("\n🎉 任务完成！")
-        print(f"文件已保存至: {excel_path}")
-        print(f"总共成功插入 {success_count} 张图片/页面。")
+        log("\n🎉 任务完成！")
+        log(f"文件已保存至: {excel_path}")
+        log(f"总共成功插入 {success_count} 张图片/页面。")
     except Exception as e:
-        print(f"\n致命错误: 无法保存 Excel 文件。请确保文件未被打开。错误: {e}")
+        log(f"\n致命错误: 无法保存 Excel 文件。请确保文件未被打开。错误: {e}")
 
 
 # --- 使用示例 ---
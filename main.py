@@ -1,11 +1,13 @@
 import os
-from typing import Dict
-from pathlib import Path
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 
 from getSimilarFolder import find_similar_subdirs 
 from copyNewFile import copy_and_rename_file, find_monthly_xlsx_files, MONTH_REPLACEMENTS
 from insertPic2Excel import insert_images_to_excel_with_pdf
-from utility import format_file_list_output
+from utility import iter_formatted_file_list, PATH_SEPARATORS
 
 # -----------------------------------------------------------
 # I. 辅助变量定义
@@ -13,12 +15,155 @@ from utility import format_file_list_output
 
 # 替换映射表 (从您的代码中复制)
 IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.pdf') # 包含 .pdf
+# 小写形式的扩展名元组 (即便上面的列表中混入大写扩展名也能正确比较)
+IMAGE_EXTENSIONS_LOWER = tuple(ext.lower() for ext in IMAGE_EXTENSIONS)
+# 由上面的扩展名列表生成的预编译正则 (忽略大小写)，匹配文件名末尾的扩展名，
+# 无需为每个文件名生成小写副本或切片出扩展名
+_IMG_RE = re.compile(r"\.(?:" + "|".join(re.escape(ext[1:]) for ext in IMAGE_EXTENSIONS_LOWER) + r")\Z", re.IGNORECASE)
+_match_image_name = _IMG_RE.search
 FOLD_NAME_FILTER ="NOV"
+MAPPING_WORKERS = 8 # 并行处理报告/图片文件夹对的最大线程数
 
 # -----------------------------------------------------------
 # II. 主控函数
 # -----------------------------------------------------------
 
+def _folder_name(path: str) -> str:
+    """
+    返回文件夹路径的最后一级名称，仅用于显示。
+    纯字符串操作，无需构造 Path 对象；先去掉末尾分隔符，否则 basename 会返回空字符串。
+
+    参数:
+    path (str): 文件夹路径。
+
+    返回:
+    str: 文件夹名称。
+    """
+    return os.path.basename(path.rstrip(PATH_SEPARATORS))
+
+def _is_readable_dir(path: str) -> bool:
+    """
+    通过一次 os.scandir 探测目录：既校验路径是可读取的目录，又会让内核的目录缓存预热，
+    后续 find_similar_subdirs 对同一目录的遍历因此更快。
+
+    参数:
+    path (str): 要检查的路径。
+
+    返回:
+    bool: 路径存在且是目录时为 True。
+    """
+    try:
+        with os.scandir(path):
+            return True
+    except (FileNotFoundError, NotADirectoryError):
+        return False
+    except OSError:
+        # 例如没有读取权限：此时与原先的 os.path.isdir 判定保持一致
+        return os.path.isdir(path)
+
+def _collect_images(image_dir: str, log: List[str]) -> List[str]:
+    """
+    收集图片文件夹下 (不含子目录) 所有图片和 PDF 文件的路径。
+
+    参数:
+    image_dir (str): 图片文件夹路径。
+    log (List[str]): 当前文件夹对的日志缓冲，出错时写入错误信息。
+
+    返回:
+    List[str]: 图片/PDF 文件路径列表。
+    """
+    files = []
+    try:
+        # 使用 os.scandir 遍历 image_dir 目录下的所有条目：
+        # DirEntry 自带文件类型信息和完整路径，无需对每个条目再 stat 和拼接路径
+        with os.scandir(image_dir) as it:
+            for entry in it:
+                # 1. 先用预编译正则做廉价的扩展名检查 (无需 lower() 或 splitext)，
+                #    绝大多数不相关的条目 (包括子目录) 在这里就被排除，不会触发任何文件类型查询
+                if _match_image_name(entry.name) is None:
+                    continue
+
+                # 2. 再检查条目是否是文件 (排除名字恰好以图片扩展名结尾的子目录)
+                if entry.is_file():
+                    files.append(entry.path)
+    except FileNotFoundError:
+        log.append(f"警告: 目录未找到 - {image_dir}")
+    except Exception as e:
+        log.append(f"在收集文件时发生错误: {e}")
+    return files
+
+def _process_mapping(current_report_folder_path: str, best_match_image_path: str, ratio: float) -> Tuple[Optional[List[str]], List[str]]:
+    """
+    处理一对报告/图片文件夹：查找 10 月 Excel、复制为 11 月版本，并插入图片文件夹中的图片和 PDF。
+    单独成函数，每处理完一对文件夹，其中的局部变量 (如目录条目列表) 即可被及时释放；
+    各文件夹对之间互不依赖 (写入的是各自的目标 Excel)，因此可以在线程池中并行执行。
+
+    参数:
+    current_report_folder_path (str): 报告子文件夹路径。
+    best_match_image_path (str): 与之匹配的图片子文件夹路径。
+    ratio (float): 两个文件夹名称的相似度。
+
+    返回:
+    Tuple[Optional[List[str]], List[str]]: (被处理的图片/PDF 文件路径列表, 本文件夹对的全部输出行)。
+        如果该报告文件夹被跳过 (未找到或未能复制 Excel 文件)，文件列表为 None。
+        本函数不直接写标准输出：包括被调用函数在内的所有信息都收集在输出行中，由调用方统一写出，
+        因此并行处理时各文件夹对的输出不会相互交错。
+    """
+    # 本文件夹对的全部状态信息：log.append 同时作为 copy_and_rename_file 等函数的输出函数
+    log: List[str] = []
+
+    # --- 2.1 查找 10 月份的 Excel 文件 ---
+    # 假设我们只对每个子文件夹中找到的第一个 10 月文件进行操作：
+    # find_monthly_xlsx_files 是生成器，取到第一个结果后即停止遍历
+    first_report_file = next(find_monthly_xlsx_files(current_report_folder_path, log.append), None)
+    
+    if first_report_file is None:
+        # 没有 10 月文件的映射直接跳过，不做任何其他工作 (包括图片目录的扫描)
+        log.append(f"\n❌ 警告: 未在报告子文件夹 '{_folder_name(current_report_folder_path)}' 中找到 10 月份的 XLSX 文件，跳过。")
+        return (None, log)
+
+    report_folder_name = _folder_name(current_report_folder_path)
+    image_folder_name = _folder_name(best_match_image_path)
+    
+    log.append(f"\n>>>> 正在处理报告文件夹: {report_folder_name} (图片源: {image_folder_name}, 相似度: {ratio:.2f}) <<<<")
+
+    source_excel_path, matched_keyword = first_report_file
+    log.append(f"✅ 找到源 Excel: {os.path.basename(source_excel_path)}")
+
+    # --- 2.2 复制并重命名为 11 月版本 ---
+    # 注意：这里不能直接沿用映射中的报告文件夹路径。find_monthly_xlsx_files 会递归搜索子目录，
+    # 找到的 Excel 可能位于更深的嵌套目录中，而新文件需要与源文件放在同一目录下
+    current_report_folder_path=os.path.dirname(source_excel_path)
+    new_excel_path = copy_and_rename_file(source_excel_path, matched_keyword, current_report_folder_path, log=log.append)
+    
+    if not new_excel_path:
+        log.append("❌ 错误: 文件复制或重命名失败，跳过后续步骤。")
+        return (None, log)
+        
+    log.append(f"✅ 创建 11 月文件: {os.path.basename(new_excel_path)}")
+
+    # --- 2.3 收集图片和 PDF 文件路径 ---
+    
+    image_and_pdf_files = _collect_images(best_match_image_path, log)
+
+    if not image_and_pdf_files:
+        log.append("❌ 警告: 图片文件夹中未找到任何图片或 PDF 文件。")
+    else:
+        log.append(f"✅ 找到 {len(image_and_pdf_files)} 个图片/PDF 文件。")
+
+        # --- 2.4 查找 Excel 目标位置和工作表名称 ---
+        
+        # --- 2.5 插入图片和 PDF ---
+        insert_images_to_excel_with_pdf(
+            excel_path=new_excel_path,
+            file_paths=image_and_pdf_files,
+            log=log.append,
+        )
+        log.append(f"✅ 图片/PDF 插入完成。")
+
+    log.append("<<<< 当前文件夹处理完毕 >>>>")
+    return (image_and_pdf_files, log)
+
 def automate_monthly_report_prep_final(base_report_dir: str, base_image_dir: str, similarity_threshold: float = 0.7) -> None:
     """
     协调整个任务流程的主函数，第一步直接调用 find_similar_subdirs 获取目录映射。
@@ -29,10 +174,10 @@ def automate_monthly_report_prep_final(base_report_dir: str, base_image_dir: str
     similarity_threshold (float): 查找相似图片目录的相似度阈值。
     """
     
-    if not os.path.isdir(base_report_dir):
+    if not _is_readable_dir(base_report_dir):
         print(f"❌ 错误: 报告基础路径不存在: {base_report_dir}")
         return
-    if not os.path.isdir(base_image_dir):
+    if not _is_readable_dir(base_image_dir):
         print(f"❌ 错误: 图片基础路径不存在: {base_image_dir}")
         return
 
@@ -61,78 +206,30 @@ def automate_monthly_report_prep_final(base_report_dir: str, base_image_dir: str
     
     total_processed_folders = 0
 
-    # --- 2. 循环遍历映射并执行复制/插入操作 ---
+    # --- 2. 并行处理各映射，执行复制/插入操作 ---
+    # 每对文件夹的处理以文件 I/O (扫描目录、复制 Excel、读取图片/PDF) 为主，线程可以重叠这些等待；
+    # 各任务返回自己的图片列表和收集到的输出行，在主线程中按提交顺序 (即 directory_mappings 的顺序)
+    # 逐个写出输出并汇总图片列表：每个文件夹的输出连续完整，顺序也与串行处理时一致，不随线程完成的先后变化。
+    # PDF 渲染 (PyMuPDF 不支持多线程) 由 insertPic2Excel 内部的锁串行化
     all_images_processed=[]
-    for current_report_folder_path, best_match_image_path, ratio in directory_mappings:
-        report_folder_name = Path(current_report_folder_path).name
-        image_folder_name = Path(best_match_image_path).name
-        
-        print(f"\n>>>> 正在处理报告文件夹: {report_folder_name} (图片源: {image_folder_name}, 相似度: {ratio:.2f}) <<<<")
-
-        # --- 2.1 查找 10 月份的 Excel 文件 ---
-        report_files = find_monthly_xlsx_files(current_report_folder_path)
-        
-        if not report_files:
-            print("❌ 警告: 未在当前报告子文件夹中找到 10 月份的 XLSX 文件，跳过。")
-            continue
-
-        # 假设我们只对每个子文件夹中找到的第一个 10 月文件进行操作
-        source_excel_path, matched_keyword = report_files[0]
-        print(f"✅ 找到源 Excel: {os.path.basename(source_excel_path)}")
-
-        # --- 2.2 复制并重命名为 11 月版本 ---
-        # current_report_folder_path=r"c:\yy\test"
-        current_report_folder_path=os.path.dirname(source_excel_path)
-        new_excel_path = copy_and_rename_file(source_excel_path, matched_keyword, current_report_folder_path)
-        
-        if not new_excel_path:
-            print("❌ 错误: 文件复制或重命名失败，跳过后续步骤。")
-            continue
-            
-        print(f"✅ 创建 11 月文件: {os.path.basename(new_excel_path)}")
-
-        # --- 2.3 收集图片和 PDF 文件路径 ---
-        
-        image_and_pdf_files = []
-        try:
-            # 遍历 best_match_image_path 目录下的所有条目
-            for item_name in os.listdir(best_match_image_path):
-                file_path = os.path.join(best_match_image_path, item_name)
-                
-                # 1. 检查条目是否是文件 (排除子目录)
-                if os.path.isfile(file_path):
-                    ext = os.path.splitext(item_name)[1].lower()
-                    
-                    # 2. 检查扩展名是否在允许的列表中
-                    if ext in IMAGE_EXTENSIONS:
-                        image_and_pdf_files.append(file_path)
-                        all_images_processed.append(file_path)
-        except FileNotFoundError:
-            print(f"警告: 目录未找到 - {best_match_image_path}")
-        except Exception as e:
-            print(f"在收集文件时发生错误: {e}")
-
-        if not image_and_pdf_files:
-            print("❌ 警告: 图片文件夹中未找到任何图片或 PDF 文件。")
-        else:
-            print(f"✅ 找到 {len(image_and_pdf_files)} 个图片/PDF 文件。")
-
-            # --- 2.4 查找 Excel 目标位置和工作表名称 ---
-            
-            # --- 2.5 插入图片和 PDF ---
-            insert_images_to_excel_with_pdf(
-                excel_path=new_excel_path,
-                file_paths=image_and_pdf_files,
-            )
-            print(f"✅ 图片/PDF 插入完成。")
-
-        total_processed_folders += 1
-        print("<<<< 当前文件夹处理完毕 >>>>")
+    max_workers = min(MAPPING_WORKERS, len(directory_mappings))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_process_mapping, *mapping) for mapping in directory_mappings]
+        for future in futures:
+            processed_files, lines = future.result()
+            # 一次 write 写出该文件夹对的全部输出
+            sys.stdout.write("\n".join(lines) + "\n")
+            if processed_files is not None:
+                total_processed_folders += 1
+                all_images_processed.extend(processed_files)
+
+    # 已完成的 future (各自持有其结果列表) 只在处理阶段有用，处理完毕后立即释放，不随汇总输出一直保留
+    del futures
         
     print(f"\n\n🎉🎉 自动化流程全部完成！总共处理了 {total_processed_folders} 个文件夹。 🎉🎉")
-    formatted_output = format_file_list_output(all_images_processed)
     print("--- 所有被处理的图片/PDF文件列表 ---")
-    print(formatted_output)
+    # 逐行写出汇总，而不是先拼接出完整的字符串再打印
+    sys.stdout.writelines(line + "\n" for line in iter_formatted_file_list(all_images_processed))
 
 
 # --- 执行示例 ---
@@ -0,0 +1,41 @@
+from datetime import datetime
+
+import pytest
+
+openpyxl = pytest.importorskip("openpyxl")
+pytest.importorskip("fitz")
+PILImage = pytest.importorskip("PIL.Image")
+
+import insertPic2Excel
+
+
+def _marker_rows(excel_path, sheet_name):
+    """返回工作表中 O 列为当前月份标记的所有行号"""
+    marker = datetime.now().strftime("%Y-%m")
+    sheet = openpyxl.load_workbook(excel_path)[sheet_name]
+    return [
+        row_num
+        for row_num, (value,) in enumerate(sheet.iter_rows(min_col=15, max_col=15, values_only=True), 1)
+        if value == marker
+    ]
+
+
+def test_insert_again_after_reload_uses_displayed_image_height(tmp_path):
+    """保存并重新加载后再次插入：大图片按显示高度 (而非原始像素) 计算覆盖行，标记行紧跟在图片之后"""
+    excel_path = str(tmp_path / "report.xlsx")
+    sheet_name = "2025 Receipts"
+    workbook = openpyxl.Workbook()
+    workbook.active.title = sheet_name
+    workbook.save(excel_path)
+
+    # 3000x4000 的图片会被缩放到 300x400 显示
+    image_path = str(tmp_path / "photo.png")
+    PILImage.new("RGB", (3000, 4000), "white").save(image_path)
+
+    # 第一次：第 1 行被标记，图片从第 2 行插入 (第 2 行行高随图片调整)
+    insertPic2Excel.insert_images_to_excel_with_pdf(excel_path, [image_path])
+    assert _marker_rows(excel_path, sheet_name) == [1]
+
+    # 第二次：重新加载工作簿，图片只覆盖第 2 行，新的标记行应为第 3 行
+    insertPic2Excel.insert_images_to_excel_with_pdf(excel_path, [image_path])
+    assert _marker_rows(excel_path, sheet_name) == [1, 3]
@@ -1,55 +1,88 @@
 import os
+from collections import defaultdict
+from typing import Iterator
 
-def format_file_list_output(file_list: list) -> str:
+PATH_SEPARATORS = os.sep + (os.altsep or '') # 当前平台的所有路径分隔符，供 rstrip 等去除末尾分隔符
+
+def iter_formatted_file_list(file_list: list) -> Iterator[str]:
     """
-    将文件路径列表格式化为易读的多行输出。
+    逐行生成文件路径列表的格式化输出 (每行不含换行符)。
+    调用方可以直接把各行写到输出流中，无需先拼接出完整的字符串。
     """
     if not file_list:
-        return "（无文件被处理）"
+        yield "（无文件被处理）"
+        return
+
+    if len(file_list) == 1:
+        # 只有一个文件时 (常见于某个文件夹只找到一张图片)，共同目录就是它所在的文件夹，
+        # 直接输出，省去 commonpath、relpath 和分组字典
+        directory, filename = os.path.split(file_list[0])
+        if directory:
+            yield f"📁 根目录: {directory}"
+            yield "-" * 30
+        yield "└─ 📁 文件夹: (根目录)"
+        yield f"    * 文件: {filename}"
+        yield ""
+        return
 
-    # 使用字典来按父目录分组
-    grouped_files = {}
+    # 使用字典来按父目录分组 (defaultdict 免去每个路径的 "in" 检查)
+    grouped_files = defaultdict(list)
     
     # 查找所有路径的共同根目录，以便输出时进行简化
-    common_prefix = os.path.commonprefix(file_list)
+    # 使用按路径组件比较的 commonpath，而不是逐字符比较的 commonprefix，
+    # 后者可能返回不完整的目录名 (例如 "/x/Pro" 同时是 "/x/Project1" 和 "/x/Project2" 的前缀)
+    try:
+        common_prefix = os.path.commonpath(file_list)
+    except ValueError:
+        # 混合了绝对/相对路径或位于不同驱动器上，无法计算共同目录
+        common_prefix = ''
+    if common_prefix in file_list:
+        # 所有路径都是同一个文件时，共同目录是它所在的文件夹
+        common_prefix = os.path.dirname(common_prefix)
     
     for path in file_list:
         # 简化路径，移除共同前缀
-        relative_path = path[len(common_prefix):].lstrip(os.path.sep)
+        relative_path = os.path.relpath(path, common_prefix) if common_prefix else path
         
-        # 将文件路径拆分成目录和文件名
-        directory = os.path.dirname(relative_path)
-        filename = os.path.basename(relative_path)
+        # 将文件路径拆分成目录和文件名：一次 rpartition 同时得到两部分，
+        # 而不是让 dirname 和 basename 各自再扫描一遍字符串
+        head, sep, filename = relative_path.rpartition(os.sep)
+        if not sep and os.altsep:
+            # Windows 上的路径可能使用 '/' 分隔
+            head, sep, filename = relative_path.rpartition(os.altsep)
+        # 与 dirname 一致：去掉目录末尾多余的分隔符，但保留根目录本身 (例如 "/")
+        directory = (head.rstrip(PATH_SEPARATORS) or sep) if sep else ''
         
-        if directory not in grouped_files:
-            grouped_files[directory] = []
-        
-        # 对临时文件（_temp_img）进行特殊标记
-        if '_temp_img' in directory:
-            grouped_files[directory].append(f"  └─ 🖼️ 临时文件: {filename}")
-        else:
-            # 原始文件
-            grouped_files[directory].append(f" * 文件: {filename}")
+        grouped_files[directory].append(filename)
 
-    output_lines = []
     # 如果公共前缀有意义（不为空），先打印出来
     if common_prefix:
-        output_lines.append(f"📁 根目录: {common_prefix}")
-        output_lines.append("-" * 30)
+        yield f"📁 根目录: {common_prefix}"
+        yield "-" * 30
 
     # 按目录输出
-    for directory, files in grouped_files.items():
+    for directory, filenames in grouped_files.items():
+        # 对临时文件（_temp_img）进行特殊标记：每个目录只判断一次，再套用到该目录下的所有文件
+        if '_temp_img' in directory:
+            file_format = "     └─ 🖼️ 临时文件: {}"
+        else:
+            # 原始文件
+            file_format = "    * 文件: {}"
+
         if directory:
-            output_lines.append(f"└─ 📂 文件夹: {directory}/")
-            for file in files:
-                output_lines.append(f"   {file}")
+            yield f"└─ 📂 文件夹: {directory}/"
         else:
             # 根目录下的文件
-            output_lines.append("└─ 📁 文件夹: (根目录)")
-            for file in files:
-                 output_lines.append(f"   {file}")
-        output_lines.append("") # 目录间增加空行
-            
-    return "\n".join(output_lines)
+            yield "└─ 📁 文件夹: (根目录)"
+        for filename in filenames:
+            yield file_format.format(filename)
+        yield "" # 目录间增加空行
+
+
+def format_file_list_output(file_list: list) -> str:
+    """
+    将文件路径列表格式化为易读的多行输出。
+    """
+    return "\n".join(iter_formatted_file_list(file_list))
 
 